@@ -0,0 +1,295 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+# --- FORMATO DEL SNAPSHOT ---
+# [cabecera][tabla de filas (tamaño fijo)][tabla de strings UTF-8]
+# Cada fila guarda el id y (offset, largo) de sus strings dentro de la tabla de strings,
+# así cualquier fila se lee sin recorrer las anteriores.
+MAGIC = b"ETQS"
+VERSION = 2
+CABECERA = struct.Struct("<4sIqqI20sQ")  # magic, versión, mtime_ns y tamaño de la DB, filas, sha1 del contenido, bytes de strings
+FILA = struct.Struct("<q10I")            # id + (offset, largo) de carpeta, articulo, medida, cantidad, busqueda
+ID_FILA = struct.Struct("<q")            # id, al principio de cada fila
+REF_BUSQUEDA = struct.Struct("<II")      # (offset, largo) de busqueda, al final de cada fila
+POS_BUSQUEDA = FILA.size - REF_BUSQUEDA.size
+NULO = 0xFFFFFFFF                        # largo que representa None
+
+
+def texto_busqueda(carpeta, articulo, medida):
+    """Texto normalizado contra el que se buscan los términos del buscador"""
+    return f"{carpeta} {medida} {articulo}".lower().replace("-", "/")
+
+
+def clave_orden(etiqueta):
+    return f"{etiqueta.articulo} {etiqueta.medida}".lower()
+
+
+def ruta_snapshot(db_path):
+    """El snapshot vive al lado de la base: etiquetas.db -> etiquetas.catalogo"""
+    return os.path.splitext(db_path)[0] + ".catalogo"
+
+
+def firma_db(db_path):
+    st = os.stat(db_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def hash_contenido(etiquetas):
+    """sha1 de todas las filas en orden de id; no depende del orden de entrada."""
+    h = hashlib.sha1()
+    for e in sorted(etiquetas, key=lambda e: e.id):
+        h.update(repr((e.id, e.carpeta, e.articulo, e.medida, str(e.cantidad))).encode("utf-8"))
+    return h.digest()
+
+
+class EtiquetaCatalogo:
+    """Fila del catálogo que usa la GUI: datos de la etiqueta + texto de búsqueda normalizado"""
+    __slots__ = ("id", "carpeta", "articulo", "medida", "cantidad", "busqueda")
+
+    def __init__(self, id, carpeta, articulo, medida, cantidad, busqueda=None):
+        self.id = id
+        self.carpeta = carpeta
+        self.articulo = articulo
+        self.medida = medida
+        self.cantidad = cantidad
+        self.busqueda = busqueda if busqueda is not None else texto_busqueda(carpeta, articulo, medida)
+
+    @classmethod
+    def desde(cls, etiqueta):
+        return cls(etiqueta.id, etiqueta.carpeta, etiqueta.articulo, etiqueta.medida, etiqueta.cantidad)
+
+    def actualizar(self, **datos):
+        """Aplica cambios ya guardados en la DB y recalcula el texto de búsqueda."""
+        for clave, valor in datos.items():
+            setattr(self, clave, valor)
+        self.busqueda = texto_busqueda(self.carpeta, self.articulo, self.medida)
+
+
+def _cantidad_desde_texto(texto):
+    # La columna es Integer, pero SQLite guarda lo que le den (la UI permite texto)
+    if texto is not None and texto.lstrip("-").isdigit() and str(int(texto)) == texto:
+        return int(texto)
+    return texto
+
+
+# ----------------------------------------------------------------------
+# ESCRITURA
+# ----------------------------------------------------------------------
+
+def escribir_snapshot(db_path, etiquetas, firma=None):
+    """
+    Escribe el snapshot del catálogo (ordenado y normalizado) al lado de la DB.
+    firma es la de firma_db() tomada ANTES de leer las etiquetas, para que una
+    escritura concurrente deje el snapshot desactualizado y no aparentemente vigente.
+    Se escribe a un temporal y se reemplaza con os.replace.
+    """
+    filas = sorted((EtiquetaCatalogo.desde(e) for e in etiquetas), key=clave_orden)
+    mtime_ns, tamaño = firma if firma is not None else firma_db(db_path)
+
+    strings = bytearray()
+    tabla = bytearray()
+    for fila in filas:
+        refs = []
+        for valor in (fila.carpeta, fila.articulo, fila.medida,
+                      None if fila.cantidad is None else str(fila.cantidad), fila.busqueda):
+            if valor is None:
+                refs += [0, NULO]
+                continue
+            datos = valor.encode("utf-8")
+            refs += [len(strings), len(datos)]
+            strings += datos
+        tabla += FILA.pack(fila.id, *refs)
+
+    cabecera = CABECERA.pack(MAGIC, VERSION, mtime_ns, tamaño, len(filas), hash_contenido(filas), len(strings))
+
+    destino = ruta_snapshot(db_path)
+    fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(destino)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(cabecera)
+            f.write(tabla)
+            f.write(strings)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, destino)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# ----------------------------------------------------------------------
+# LECTURA
+# ----------------------------------------------------------------------
+
+class Subconjunto:
+    """Resultado de una búsqueda: índices del catálogo, las filas se piden de a una"""
+    __slots__ = ("catalogo", "indices")
+
+    def __init__(self, catalogo, indices):
+        self.catalogo = catalogo
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, k):
+        return self.catalogo.fila(self.indices[k])
+
+
+class CatalogoSnapshot:
+    """
+    Vista perezosa de solo lectura sobre el snapshot mapeado en memoria.
+    Solo se decodifican las filas que se piden (y quedan cacheadas, así las
+    ediciones hechas en memoria se conservan); la búsqueda recorre la tabla
+    de strings sin crear objetos. cerrar() libera el mapeo (en Windows no se
+    puede reemplazar un archivo mapeado).
+    """
+    def __init__(self, ruta):
+        self._filas = {}
+        self._lock = threading.Lock()   # cerrar() vs. hash_decodificado() desde otro hilo
+        with open(ruta, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.db_mtime_ns, self.db_tamaño,
+             self.n_filas, self.hash, largo_strings) = CABECERA.unpack_from(self.mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("snapshot con formato desconocido")
+            self.inicio_strings = CABECERA.size + self.n_filas * FILA.size
+            if len(self.mm) != self.inicio_strings + largo_strings:
+                raise ValueError("snapshot truncado")
+        except BaseException:
+            self.mm.close()
+            raise
+
+    @classmethod
+    def abrir(cls, db_path):
+        """Abre el snapshot si existe y corresponde a la DB actual; si no, devuelve None."""
+        try:
+            catalogo = cls(ruta_snapshot(db_path))
+        except (OSError, ValueError, struct.error):
+            return None
+        try:
+            if (catalogo.db_mtime_ns, catalogo.db_tamaño) != firma_db(db_path):
+                catalogo.cerrar()
+                return None
+        except OSError:
+            catalogo.cerrar()
+            return None
+        return catalogo
+
+    def __len__(self):
+        return self.n_filas
+
+    def __getitem__(self, i):
+        return self.fila(i)
+
+    def _string(self, offset, largo):
+        if largo == NULO:
+            return None
+        inicio = self.inicio_strings + offset
+        return self.mm[inicio:inicio + largo].decode("utf-8")
+
+    def _decodificar(self, i):
+        id_, *refs = FILA.unpack_from(self.mm, CABECERA.size + i * FILA.size)
+        carpeta, articulo, medida, cantidad, busqueda = (
+            self._string(refs[j], refs[j + 1]) for j in range(0, 10, 2)
+        )
+        return EtiquetaCatalogo(id_, carpeta, articulo, medida, _cantidad_desde_texto(cantidad), busqueda)
+
+    def fila(self, i):
+        fila = self._filas.get(i)
+        if fila is None:
+            fila = self._decodificar(i)
+            self._filas[i] = fila
+        return fila
+
+    def hash_decodificado(self):
+        """
+        hash_contenido de lo que el archivo realmente decodifica (no el de la
+        cabecera ni las ediciones en memoria). Se puede llamar desde otro hilo.
+        Devuelve None si el catálogo se cierra mientras tanto o si algún texto
+        de búsqueda no corresponde a su fila (el hash no lo cubre).
+        """
+        filas = []
+        for i in range(self.n_filas):
+            with self._lock:
+                if self.mm.closed:
+                    return None
+                fila = self._decodificar(i)
+            if fila.busqueda != texto_busqueda(fila.carpeta, fila.articulo, fila.medida):
+                return None
+            filas.append(fila)
+        return hash_contenido(filas)
+
+    def posiciones(self, ids):
+        """Índice en el catálogo de cada id pedido (solo lee los ids de la tabla de filas)."""
+        ids = set(ids)
+        posiciones = {}
+        for i in range(self.n_filas):
+            id_, = ID_FILA.unpack_from(self.mm, CABECERA.size + i * FILA.size)
+            if id_ in ids:
+                posiciones[id_] = i
+        return posiciones
+
+    def buscar(self, terminos):
+        """
+        Filas (en orden) cuyo texto de búsqueda contiene todos los términos.
+        Se compara en UTF-8 directamente sobre el mapeo; las filas ya
+        decodificadas usan su texto actual por si fueron editadas.
+        """
+        terminos_bytes = [t.encode("utf-8") for t in terminos]
+        mm = self.mm
+        indices = []
+        for i in range(self.n_filas):
+            fila = self._filas.get(i)
+            if fila is not None:
+                if all(t in fila.busqueda for t in terminos):
+                    indices.append(i)
+                continue
+            offset, largo = REF_BUSQUEDA.unpack_from(mm, CABECERA.size + i * FILA.size + POS_BUSQUEDA)
+            inicio = self.inicio_strings + offset
+            fin = inicio + largo
+            if all(mm.find(t, inicio, fin) != -1 for t in terminos_bytes):
+                indices.append(i)
+        return Subconjunto(self, indices)
+
+    def cerrar(self):
+        self._filas.clear()
+        with self._lock:
+            self.mm.close()
+
+
+class CatalogoEnMemoria:
+    """
+    Misma interfaz que CatalogoSnapshot, con las filas en memoria.
+    Se usa cuando no se pudo escribir o abrir el snapshot: es solo una cache.
+    """
+    def __init__(self, etiquetas):
+        self._filas = sorted((EtiquetaCatalogo.desde(e) for e in etiquetas), key=clave_orden)
+        self.hash = hash_contenido(self._filas)
+
+    def __len__(self):
+        return len(self._filas)
+
+    def __getitem__(self, i):
+        return self.fila(i)
+
+    def fila(self, i):
+        return self._filas[i]
+
+    def buscar(self, terminos):
+        return Subconjunto(self, [
+            i for i, fila in enumerate(self._filas) if all(t in fila.busqueda for t in terminos)
+        ])
+
+    def posiciones(self, ids):
+        ids = set(ids)
+        return {fila.id: i for i, fila in enumerate(self._filas) if fila.id in ids}
+
+    def cerrar(self):
+        pass
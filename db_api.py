@@ -1,9 +1,15 @@
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+
 from sqlalchemy import create_engine, Column, Integer, String, or_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 
 # --- CONFIGURACIÓN INICIAL ---
+DB_PATH_DEFAULT = "etiquetas.db"
 Base = declarative_base()
 
 class Etiqueta(Base):
@@ -19,13 +25,109 @@ class Etiqueta(Base):
     def __repr__(self):
         return f"ID: {self.id} | Art: {self.articulo} | Med: {self.medida} | Cant: {self.cantidad}"
 
+@dataclass(frozen=True)
+class EtiquetaSnapshot:
+    """Copia inmutable de una etiqueta, segura para pasar entre hilos"""
+    id: int
+    carpeta: str
+    articulo: str
+    medida: str
+    cantidad: int
+
+    @classmethod
+    def desde(cls, etiqueta):
+        return cls(
+            id=etiqueta.id,
+            carpeta=etiqueta.carpeta,
+            articulo=etiqueta.articulo,
+            medida=etiqueta.medida,
+            cantidad=etiqueta.cantidad,
+        )
+
+# --- ESCRITOR ÚNICO ---
+class EscritorEtiquetas:
+    """
+    Hilo único que ejecuta todas las escrituras a la base en orden.
+    SQLite admite un solo escritor a la vez: serializando acá evitamos
+    los 'database is locked' cuando la UI y los hilos de fondo escriben juntos.
+    """
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.cola = queue.Queue()
+        self.hilo = threading.Thread(target=self._worker, daemon=True)
+        self.hilo.start()
+
+    def ejecutar(self, operacion, *args, **kwargs):
+        """Encola operacion(session, *args, **kwargs) y espera su resultado."""
+        futuro = Future()
+        self.cola.put((futuro, operacion, args, kwargs))
+        return futuro.result()
+
+    def _worker(self):
+        while True:
+            futuro, operacion, args, kwargs = self.cola.get()
+            session = self.session_factory()
+            try:
+                futuro.set_result(operacion(session, *args, **kwargs))
+            except Exception as e:
+                session.rollback()
+                futuro.set_exception(e)
+            finally:
+                session.close()
+
+def _crear(session, articulo, medida, cantidad, carpeta):
+    nueva_carpeta = carpeta
+    if carpeta:
+        medida_pat_1 = medida.lower().split("x")[0].replace("/","-").strip()
+        nueva_carpeta = f"{carpeta}\\{medida_pat_1}"
+    nueva = Etiqueta(articulo=articulo, medida=medida, cantidad=cantidad, carpeta=nueva_carpeta)
+    session.add(nueva)
+    session.commit()
+    return EtiquetaSnapshot.desde(nueva)
+
+def _modificar(session, etiqueta_id, cambios):
+    etiqueta = session.get(Etiqueta, etiqueta_id)
+    if not etiqueta:
+        return False
+    for clave, valor in cambios.items():
+        if hasattr(etiqueta, clave):
+            setattr(etiqueta, clave, valor)
+    session.commit()
+    return True
+
+def _eliminar(session, etiqueta_id):
+    etiqueta = session.get(Etiqueta, etiqueta_id)
+    if not etiqueta:
+        return False
+    session.delete(etiqueta)
+    session.commit()
+    return True
+
+# --- RECURSOS COMPARTIDOS POR PROCESO ---
+# Un engine, una fábrica de sesiones y un escritor por base de datos.
+_recursos = {}
+_recursos_lock = threading.Lock()
+
+def _obtener_recursos(db_path):
+    with _recursos_lock:
+        if db_path not in _recursos:
+            engine = create_engine(db_path, echo=False, connect_args={"timeout": 30})
+            Base.metadata.create_all(engine) # Crea la tabla si no existe
+            factory = sessionmaker(bind=engine)
+            _recursos[db_path] = (engine, factory, EscritorEtiquetas(factory))
+        return _recursos[db_path]
+
 # --- CLASE DE GESTIÓN (INTERFAZ) ---
 class EtiquetaManager:
-    def __init__(self, db_path_param="etiquetas.db"):
+    """
+    Acceso a datos seguro entre hilos: cada manager tiene su propia sesión
+    y se usa solo desde el hilo que lo creó; las escrituras pasan por el
+    EscritorEtiquetas. Los objetos ORM devueltos no deben compartirse con
+    otros hilos; para eso usar obtener_snapshot / EtiquetaSnapshot.
+    """
+    def __init__(self, db_path_param=DB_PATH_DEFAULT):
         db_path = f"sqlite:///{db_path_param}"
-        self.engine = create_engine(db_path, echo=False)
-        Base.metadata.create_all(self.engine) # Crea la tabla si no existe
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine, self.Session, self.escritor = _obtener_recursos(db_path)
         self.session = self.Session()
 
     # 1. LISTAR
@@ -36,14 +138,10 @@ class EtiquetaManager:
 
     # 2. CREAR
     def crear(self, articulo, medida, cantidad, carpeta=""):
-        """Crea y guarda una nueva etiqueta."""
+        """Crea y guarda una nueva etiqueta. Devuelve un EtiquetaSnapshot."""
         print("creando etiqueta")#borrar
-        if carpeta:
-            medida_pat_1 = medida.lower().split("x")[0].replace("/","-").strip()
-            new_carpeta = f"{carpeta}\\{medida_pat_1}"
-        nueva = Etiqueta(articulo=articulo, medida=medida, cantidad=cantidad, carpeta=new_carpeta)
-        self.session.add(nueva)
-        self.session.commit()
+        nueva = self.escritor.ejecutar(_crear, articulo, medida, cantidad, carpeta)
+        self.session.expire_all()
         return nueva
 
     # 3. BUSCAR
@@ -62,33 +160,31 @@ class EtiquetaManager:
     def obtener_por_id(self, etiqueta_id):
         """Busca una etiqueta específica por su ID usando el estilo SQLAlchemy 2.0."""
         return self.session.get(Etiqueta, etiqueta_id)
+
+    def obtener_snapshot(self, etiqueta_id):
+        """Igual que obtener_por_id pero devuelve una copia inmutable (o None)."""
+        etiqueta = self.obtener_por_id(etiqueta_id)
+        return EtiquetaSnapshot.desde(etiqueta) if etiqueta else None
+
     # 4. MODIFICAR
     def modificar(self, etiqueta_id, **kwargs):
         """
         Modifica campos específicos. 
         Uso: manager.modificar(1, cantidad=500, medida='1/2')
         """
-        etiqueta = self.obtener_por_id(etiqueta_id)
-        if etiqueta:
-            for clave, valor in kwargs.items():
-                if hasattr(etiqueta, clave):
-                    setattr(etiqueta, clave, valor)
-            self.session.commit()
-            return True
-        return False
+        exito = self.escritor.ejecutar(_modificar, etiqueta_id, kwargs)
+        self.session.expire_all()
+        return exito
 
     # 5. ELIMINAR
     def eliminar(self, etiqueta_id):
         """Borra una etiqueta por su ID."""
-        etiqueta = self.obtener_por_id(etiqueta_id)
-        if etiqueta:
-            self.session.delete(etiqueta)
-            self.session.commit()
-            return True
-        return False
+        exito = self.escritor.ejecutar(_eliminar, etiqueta_id)
+        self.session.expire_all()
+        return exito
 
     def cerrar(self):
-        """Cierra la conexión de la sesión."""
+        """Cierra la sesión de este manager (no afecta a otros managers del mismo hilo)."""
         self.session.close()
 
 # --- EJEMPLO DE USO ---
@@ -1,5 +1,10 @@
 import os
+import hashlib
+import shutil
 import subprocess
+import tempfile
+import time
+import weakref
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
@@ -7,7 +12,7 @@ from reportlab.pdfbase.pdfmetrics import stringWidth
 import threading
 from tools import resource_path
 
-from db_api import EtiquetaManager
+from db_api import EtiquetaManager, EtiquetaSnapshot
 
 MM = 2.83465
 PAGE_WIDTH, PAGE_HEIGHT = A4
@@ -23,6 +28,60 @@ COLUMNS = 3
 ROWS = 8
 LOGO_HEIGHT = 6 * MM
 
+# Subir este número si cambia el diseño de la hoja: invalida todos los blobs renderizados
+RENDER_VERSION = 1
+BLOBS_DIR = "_blobs"
+TMP_SUFFIX = ".tmp"
+TMP_HUERFANO_SEGUNDOS = 300   # un temporal más viejo que esto no pertenece a ningún render en curso
+
+# --- LOCKS POR RUTA ---
+# Dos escrituras del mismo archivo (preview + hilo de impresión, precalentado...)
+# nunca se pisan: cada ruta tiene su lock, compartido por todas las instancias.
+# El registro es débil: el lock de una ruta desaparece cuando nadie lo está usando.
+class _LockRuta:
+    __slots__ = ("_lock", "__weakref__")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+_locks_rutas = weakref.WeakValueDictionary()
+_locks_rutas_lock = threading.Lock()
+
+def lock_ruta(ruta):
+    clave = os.path.normcase(os.path.abspath(ruta))
+    with _locks_rutas_lock:
+        lock = _locks_rutas.get(clave)
+        if lock is None:
+            lock = _locks_rutas[clave] = _LockRuta()
+        return lock
+
+def pdf_valido(ruta):
+    """Chequeo barato de PDF completo: cabecera %PDF- y marca %%EOF al final."""
+    try:
+        with open(ruta, "rb") as f:
+            if f.read(5) != b"%PDF-":
+                return False
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+def _temporal_junto_a(ruta):
+    """Crea un archivo temporal vacío en el mismo directorio (os.replace debe ser en el mismo disco)."""
+    fd, tmp = tempfile.mkstemp(
+        prefix=".", suffix=TMP_SUFFIX, dir=os.path.dirname(os.path.abspath(ruta))
+    )
+    os.close(fd)
+    return tmp
+
 
 class EtiquetaPDFService:
     def __init__(self, base_output="etiquetas_pdf", logo_path="LOGO_LUQUE.png"):
@@ -31,6 +90,12 @@ class EtiquetaPDFService:
         #self.logo_path = logo_path
         os.makedirs(self.base_output, exist_ok=True)
 
+        # Hojas renderizadas, direccionadas por contenido (ver hash_render)
+        self.blobs_dir = os.path.join(self.base_output, BLOBS_DIR)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        with open(self.logo_path, "rb") as f:
+            self._logo_hash = hashlib.sha1(f.read()).hexdigest()
+
     # ------------------------------------------------------------------
     # UTILIDADES
     # ------------------------------------------------------------------
@@ -53,13 +118,82 @@ class EtiquetaPDFService:
 
         return os.path.join(ruta, nombre)
 
+    def hash_render(self, etiqueta):
+        """
+        Hash de todo lo que define el contenido de la hoja.
+        La carpeta no se imprime, así que no forma parte del hash.
+        """
+        datos = "\x1f".join([
+            str(RENDER_VERSION),
+            self._logo_hash,
+            str(etiqueta.articulo),
+            str(etiqueta.medida),
+            str(etiqueta.cantidad),
+        ])
+        return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+    def _ruta_blob(self, hash_render):
+        return os.path.join(self.blobs_dir, f"{hash_render}.pdf")
+
+    def _enlazar(self, ruta_blob, ruta_pdf):
+        """Deja ruta_pdf apuntando al blob: hardlink si el sistema lo permite, copia si no."""
+        with lock_ruta(ruta_pdf):
+            if os.path.exists(ruta_pdf) and os.path.samefile(ruta_blob, ruta_pdf):
+                return
+
+            tmp = _temporal_junto_a(ruta_pdf)
+            try:
+                os.remove(tmp)   # os.link necesita que el destino no exista
+                try:
+                    os.link(ruta_blob, tmp)
+                except OSError:
+                    shutil.copyfile(ruta_blob, tmp)
+                os.replace(tmp, ruta_pdf)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
     # ------------------------------------------------------------------
     # 1. CREAR PDF DE UNA ETIQUETA
     # ------------------------------------------------------------------
 
     def crear_pdf_etiqueta(self, etiqueta):
+        """
+        Deja el PDF de la etiqueta en su carpeta y devuelve la ruta.
+        Solo se renderiza si no existe ya una hoja con el mismo contenido.
+        """
         ruta_pdf = self._resolver_ruta_pdf(etiqueta)
-        c = canvas.Canvas(ruta_pdf, pagesize=A4)
+        ruta_blob = self._ruta_blob(self.hash_render(etiqueta))
+
+        # El lock del blob se mantiene mientras se enlaza: si no, la limpieza
+        # de huérfanos podría borrar un blob reutilizado justo antes de enlazarlo.
+        # Orden de locks: siempre blob -> PDF.
+        with lock_ruta(ruta_blob):
+            if not pdf_valido(ruta_blob):
+                self._renderizar_atomico(etiqueta, ruta_blob)
+            self._enlazar(ruta_blob, ruta_pdf)
+        return ruta_pdf
+
+    def _renderizar_atomico(self, etiqueta, ruta_destino):
+        """
+        Renderiza en un temporal del mismo directorio y lo mueve con os.replace:
+        quien lea ruta_destino ve el PDF anterior o el nuevo completo, nunca uno a medias.
+        """
+        tmp = _temporal_junto_a(ruta_destino)
+        try:
+            self._renderizar_hoja(etiqueta, tmp)
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp, ruta_destino)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return ruta_destino
+
+    def _renderizar_hoja(self, etiqueta, ruta_destino):
+        c = canvas.Canvas(ruta_destino, pagesize=A4)
 
         logo = ImageReader(self.logo_path)
         logo_w, logo_h = logo.getSize()
@@ -146,7 +280,7 @@ class EtiquetaPDFService:
                 c.restoreState()
 
         c.save()
-        return ruta_pdf
+        return ruta_destino
 
     
     def texto_entra_vertical(self, texto, fuente, tamaño, alto_disponible):
@@ -172,8 +306,9 @@ class EtiquetaPDFService:
     # ------------------------------------------------------------------
 
     def crear_todas_las_etiquetas(self):
+        inicio = time.time()
         manager = EtiquetaManager()
-        etiquetas = manager.listar_todas()
+        etiquetas = [EtiquetaSnapshot.desde(e) for e in manager.listar_todas()]
 
         rutas = []
         for etiqueta in etiquetas:
@@ -181,8 +316,101 @@ class EtiquetaPDFService:
             rutas.append(ruta)
 
         manager.cerrar()
+        self._eliminar_blobs_huerfanos({self.hash_render(e) for e in etiquetas}, inicio)
         return rutas
 
+    def limpiar_blobs_huerfanos(self):
+        """
+        Borra los blobs que ninguna etiqueta de la DB produce (quedan al editar
+        articulo, medida o cantidad). Devuelve la lista de blobs eliminados.
+        """
+        inicio = time.time()
+        manager = EtiquetaManager()
+        try:
+            vigentes = {self.hash_render(e) for e in manager.listar_todas()}
+        finally:
+            manager.cerrar()
+        return self._eliminar_blobs_huerfanos(vigentes, inicio)
+
+    def _eliminar_blobs_huerfanos(self, vigentes, inicio):
+        # Los blobs escritos después de leer la DB pueden ser de etiquetas nuevas: se respetan
+        eliminados = []
+        for nombre in os.listdir(self.blobs_dir):
+            hash_blob, ext = os.path.splitext(nombre)
+            if ext != ".pdf" or hash_blob in vigentes:
+                continue
+            ruta = os.path.join(self.blobs_dir, nombre)
+            with lock_ruta(ruta):
+                try:
+                    if os.path.getmtime(ruta) >= inicio:
+                        continue
+                    os.remove(ruta)
+                    eliminados.append(ruta)
+                except OSError as e:
+                    print(f"No se pudo eliminar {ruta}: {e}")
+        return eliminados
+
+    def validar_pdfs(self):
+        """
+        Revisión de arranque: borra temporales huérfanos y PDFs truncados
+        (quedan de una corrida interrumpida). Se regeneran solos al usarse.
+        Devuelve la lista de archivos eliminados.
+        """
+        eliminados = []
+        limite_tmp = time.time() - TMP_HUERFANO_SEGUNDOS
+        for carpeta, _, archivos in os.walk(self.base_output):
+            for nombre in archivos:
+                ruta = os.path.join(carpeta, nombre)
+                if nombre.endswith(TMP_SUFFIX):
+                    try:
+                        if os.path.getmtime(ruta) >= limite_tmp:
+                            continue
+                    except OSError:
+                        continue
+                elif nombre.lower().endswith(".pdf"):
+                    # Los archivos se reemplazan atómicamente: sin lock se ve uno completo
+                    # o el anterior. Solo se toma el lock para confirmar y borrar.
+                    if pdf_valido(ruta):
+                        continue
+                else:
+                    continue
+                with lock_ruta(ruta):
+                    if nombre.endswith(TMP_SUFFIX) or not pdf_valido(ruta):
+                        try:
+                            os.remove(ruta)
+                            eliminados.append(ruta)
+                        except OSError as e:
+                            print(f"No se pudo eliminar {ruta}: {e}")
+        return eliminados
+
+    def reporte_duplicados(self):
+        """
+        Agrupa las etiquetas de la DB que producen la misma hoja.
+        Devuelve un dict {"hash", "etiquetas", "exactas"} por cada grupo de
+        más de una etiqueta; "exactas" indica filas repetidas en la misma carpeta.
+        """
+        manager = EtiquetaManager()
+        try:
+            etiquetas = [EtiquetaSnapshot.desde(e) for e in manager.listar_todas()]
+        finally:
+            manager.cerrar()
+
+        grupos = {}
+        for etiqueta in etiquetas:
+            grupos.setdefault(self.hash_render(etiqueta), []).append(etiqueta)
+
+        reporte = []
+        for hash_render, grupo in grupos.items():
+            if len(grupo) < 2:
+                continue
+            carpetas = [e.carpeta for e in grupo]
+            reporte.append({
+                "hash": hash_render,
+                "etiquetas": grupo,
+                "exactas": len(set(carpetas)) < len(carpetas),
+            })
+        return reporte
+
     # ------------------------------------------------------------------
     # 3. IMPRIMIR UNA ETIQUETA CON SUMATRA
     # ------------------------------------------------------------------
@@ -194,16 +422,19 @@ class EtiquetaPDFService:
         sumatra_path="SumatraPDF.exe"
     ):
         manager = EtiquetaManager()
-        etiqueta = manager.obtener_por_id(etiqueta_id)
-        manager.cerrar()
+        try:
+            # Snapshot: este método corre en el hilo de impresión
+            etiqueta = manager.obtener_snapshot(etiqueta_id)
+        finally:
+            manager.cerrar()
 
         if not etiqueta:
             raise ValueError("Etiqueta no encontrada")
 
-        pdf_path = self._resolver_ruta_pdf(etiqueta)
-
-        if not os.path.exists(pdf_path):
-            pdf_path = self.crear_pdf_etiqueta(etiqueta)
+        # Siempre por crear_pdf_etiqueta: el archivo de la carpeta solo depende de
+        # articulo y medida, y podría ser la hoja de una cantidad anterior.
+        # Si el blob ya existe esto es solo un hash y un samefile.
+        pdf_path = self.crear_pdf_etiqueta(etiqueta)
 
         # Seguridad mínima
         cantidad_hojas = max(1, int(cantidad_hojas))
@@ -252,3 +483,10 @@ if __name__ == "__main__":
 
     # Crear todos los PDFs
     pdf_service.crear_todas_las_etiquetas()
+
+    # Etiquetas que comparten la misma hoja
+    for grupo in pdf_service.reporte_duplicados():
+        tipo = "DUPLICADO" if grupo["exactas"] else "mismo contenido"
+        print(f"{grupo['hash'][:10]} ({tipo}):")
+        for e in grupo["etiquetas"]:
+            print(f"    {e.id} | {e.carpeta} | {e.articulo} | {e.medida} | {e.cantidad}")
@@ -1,75 +1,190 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from db_api import EtiquetaManager
-from etiqueta_pdf_service import EtiquetaPDFService
-
-import fitz  # PyMuPDF
-from PIL import Image, ImageTk
-
-class VisualizadorPDF:
-    """Ventana independiente para previsualizar PDFs con scroll total y centrada"""
-    def __init__(self, parent, ruta_pdf):
-        self.top = tk.Toplevel(parent)
-        self.top.title("Previsualización de Etiqueta")
-        
-        # --- 1. CONFIGURACIÓN DE TAMAÑO Y CENTRADO ---
-        ancho_ventana = 800
-        alto_ventana = self.top.winfo_screenheight() - 100 # Casi el alto total de pantalla
-        
-        # Obtener dimensiones de la pantalla para centrar
-        screen_width = self.top.winfo_screenwidth()
-        screen_height = self.top.winfo_screenheight()
-        
-        pos_x = (screen_width // 2) - (ancho_ventana // 2)
-        pos_y = 0 # Aparece arriba centrado
-        
-        self.top.geometry(f"{ancho_ventana}x{alto_ventana}+{pos_x}+{pos_y}")
-        self.top.configure(bg="#34495e")
-
-        # --- 2. CONTENEDOR CON SCROLLS (VERTICAL Y HORIZONTAL) ---
-        # Frame contenedor para organizar canvas y barras
-        container = tk.Frame(self.top, bg="#34495e")
-        container.pack(fill="both", expand=True)
-
-        self.canvas = tk.Canvas(container, bg="grey", highlightthickness=0)
-        
-        scroll_y = tk.Scrollbar(container, orient="vertical", command=self.canvas.yview)
-        scroll_x = tk.Scrollbar(self.top, orient="horizontal", command=self.canvas.xview) # En la base de la ventana
-        
-        self.canvas.configure(yscrollcommand=scroll_y.set, xscrollcommand=scroll_x.set)
+from db_api import EtiquetaManager, EtiquetaSnapshot, DB_PATH_DEFAULT
+from catalogo_snapshot import CatalogoSnapshot, CatalogoEnMemoria, escribir_snapshot, hash_contenido, firma_db
+from etiqueta_pdf_service import EtiquetaPDFService, PAGE_WIDTH, PAGE_HEIGHT
+
+import threading
+import time
+
+from visor_pdf import (VisualizadorPDF, firma_pdf, precalentar_tiles, CACHE_TILES, clave_tile, ZOOM_PREVIEW,
+                       tiles_vista_inicial, bytes_vista_inicial)
+
+# --- PRECALENTADO EN TIEMPO OCIOSO ---
+PRECALENTAR_ESPERA_MS = 1500     # tiempo sin interacción antes de arrancar
+PRECALENTAR_MAX_ETIQUETAS = 12   # tope de candidatas por ciclo ocioso
+PRECALENTAR_FRACCION_CACHE = 0.75  # parte de CACHE_TILES que puede ocupar; el resto queda para el visor
+PRECALENTAR_ALTO_PX = 1200       # alto de la vista inicial del visor a pre-rasterizar
+PRECALENTAR_MAX_SEGUNDOS = 4.0   # presupuesto de CPU por ciclo
+PRECALENTAR_PAUSA = 0.05         # respiro entre trabajos para no competir con la UI
+PRECALENTAR_RECIENTES = 10       # etiquetas impresas que se recuerdan
+
+LOTE_FILAS = 100                 # filas de la tabla que se crean por vez al hacer scroll
+
+
+def _contenido_etiqueta(etiqueta):
+    """Clave con los campos que cambian el PDF renderizado"""
+    return (etiqueta.carpeta, etiqueta.articulo, etiqueta.medida, str(etiqueta.cantidad))
+
+
+class PrecalentadorEtiquetas:
+    """
+    Pre-renderiza PDFs y los tiles iniciales del visor para las etiquetas con
+    más probabilidad de usarse (resultados visibles e impresas recientemente)
+    mientras la UI está ociosa. Cualquier interacción del usuario lo detiene.
+    Los tiles van a la CACHE_TILES del visor: se precalientan solo tantas
+    etiquetas como entran en una parte de su límite, si no las primeras
+    candidatas se desalojarían antes de usarse.
+    """
+    def __init__(self, root, pdf_service):
+        self.root = root
+        self.pdf_service = pdf_service
+
+        self.lock = threading.Lock()
+        self.listos = {}                # id -> (contenido, ruta_pdf, firma del archivo)
+        self.recientes = []             # ids impresos, el más reciente primero
+
+        self.candidatas = []
+        self.interrumpir = threading.Event()
+        self.hilo = None
+        self.timer = None               # espera sin interacción (after)
+        self.timer_idle = None          # arranque en el próximo ocio de Tk (after_idle)
+
+        self.max_candidatas = max(1, min(
+            PRECALENTAR_MAX_ETIQUETAS,
+            int(CACHE_TILES.max_bytes * PRECALENTAR_FRACCION_CACHE)
+            // bytes_vista_inicial(PAGE_WIDTH, PAGE_HEIGHT, PRECALENTAR_ALTO_PX),
+        ))
+
+    # --- LADO TK (hilo principal) ---
+
+    def programar(self, etiquetas):
+        """
+        Actualiza las candidatas y agenda el trabajo para el próximo momento ocioso.
+        Las impresas recientes van primero aunque no estén entre los resultados
+        visibles; como puede no haber fila para ellas, se pasan solo por id y
+        el worker las lee de la DB.
+        """
+        visibles = []
+        for e in etiquetas:
+            if len(self.recientes) + len(visibles) >= self.max_candidatas:
+                break
+            if e.id not in self.recientes:
+                visibles.append(EtiquetaSnapshot.desde(e))
+        self.candidatas = visibles
+        self._reagendar()
+
+    def registrar_impresas(self, ids):
+        for etiqueta_id in ids:
+            if etiqueta_id in self.recientes:
+                self.recientes.remove(etiqueta_id)
+            self.recientes.insert(0, etiqueta_id)
+        del self.recientes[PRECALENTAR_RECIENTES:]
+
+    def interaccion(self, event=None):
+        """Corta el trabajo en curso y lo posterga hasta que el usuario deje de interactuar."""
+        self.interrumpir.set()
+        self._reagendar()
+
+    def obtener(self, etiqueta):
+        """Devuelve la ruta del PDF si ya fue pre-renderizado con el contenido actual, o None."""
+        listo = self._listo_vigente(etiqueta)
+        return listo[1] if listo else None
+
+    def _reagendar(self):
+        # Se cancelan los dos pasos: si la espera ya venció y el arranque quedó
+        # en after_idle, una interacción en el medio también tiene que frenarlo
+        if self.timer:
+            self.root.after_cancel(self.timer)
+        if self.timer_idle:
+            self.root.after_cancel(self.timer_idle)
+        self.timer_idle = None
+        self.timer = self.root.after(PRECALENTAR_ESPERA_MS, self._espera_cumplida)
+
+    def _espera_cumplida(self):
+        self.timer = None
+        self.timer_idle = self.root.after_idle(self._arrancar)
+
+    def _arrancar(self):
+        self.timer_idle = None
+        if self.hilo and self.hilo.is_alive():
+            # El hilo anterior todavía está saliendo, probamos más tarde
+            self._reagendar()
+            return
+        recientes = self.recientes[:self.max_candidatas]
+        pendientes = [e for e in self.candidatas if not self._esta_listo(e)]
+        if not pendientes and not recientes:
+            return
 
-        # Empaquetado de componentes
-        scroll_y.pack(side="right", fill="y")
-        scroll_x.pack(side="bottom", fill="x")
-        self.canvas.pack(side="left", fill="both", expand=True)
+        self.interrumpir.clear()
+        self.hilo = threading.Thread(target=self._worker, args=(recientes, pendientes), daemon=True)
+        self.hilo.start()
 
+    def _listo_vigente(self, etiqueta):
+        """Entrada de listos si coincide con el contenido actual y el archivo no cambió."""
+        with self.lock:
+            listo = self.listos.get(etiqueta.id)
+        if not listo or listo[0] != _contenido_etiqueta(etiqueta):
+            return None
         try:
-            # Abrir el PDF
-            doc = fitz.open(ruta_pdf)
-            page = doc.load_page(0)
-            
-            # Aumentamos el zoom a 2.5 para que se vea más grande y nítido
-            pix = page.get_pixmap(matrix=fitz.Matrix(2.5, 2.5)) 
-            
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            self.photo = ImageTk.PhotoImage(img)
-            
-            # Evitar Garbage Collection
-            self.canvas.image = self.photo 
-            
-            # Dibujar la imagen en el centro horizontal del scrollregion
-            # Usamos pix.width/2 para que el punto 'n' (norte/arriba) esté centrado
-            self.canvas.create_image(pix.width / 2, 20, image=self.photo, anchor="n")
-            
-            # Configurar el área de scroll exactamente al tamaño del contenido generado
-            self.canvas.config(scrollregion=(0, 0, pix.width, pix.height + 100))
-            
-            doc.close()
-            self.top.update_idletasks()
-
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo renderizar el PDF: {e}")
-            self.top.destroy()
+            if firma_pdf(listo[1]) != listo[2]:
+                return None
+        except OSError:
+            return None
+        return listo
+
+    def _esta_listo(self, etiqueta):
+        """PDF vigente y todos los tiles de la vista inicial todavía en cache."""
+        listo = self._listo_vigente(etiqueta)
+        if not listo:
+            return False
+        columnas, filas = tiles_vista_inicial(PAGE_WIDTH, PAGE_HEIGHT, PRECALENTAR_ALTO_PX)
+        return all(
+            CACHE_TILES.contiene(clave_tile(listo[2], 0, ZOOM_PREVIEW, tx, ty))
+            for ty in range(filas) for tx in range(columnas)
+        )
+
+    # --- LADO WORKER (hilo de baja prioridad) ---
+
+    def _worker(self, recientes, pendientes):
+        inicio = time.monotonic()
+        manager = EtiquetaManager() if recientes else None
+        try:
+            for etiqueta in self._candidatas_worker(manager, recientes, pendientes):
+                if self.interrumpir.is_set() or time.monotonic() - inicio > PRECALENTAR_MAX_SEGUNDOS:
+                    return
+                try:
+                    self._precalentar(etiqueta)
+                except Exception as e:
+                    print(f"Error precalentando etiqueta {etiqueta.id}: {e}")
+                time.sleep(PRECALENTAR_PAUSA)
+        finally:
+            if manager:
+                manager.cerrar()
+
+    def _candidatas_worker(self, manager, recientes, pendientes):
+        """Primero las impresas recientes (leídas de la DB, con su contenido actual), después las visibles."""
+        for etiqueta_id in recientes:
+            if self.interrumpir.is_set():
+                return
+            try:
+                etiqueta = manager.obtener_snapshot(etiqueta_id)
+            except Exception as e:
+                print(f"Error leyendo etiqueta {etiqueta_id} para precalentar: {e}")
+                continue
+            if etiqueta and not self._esta_listo(etiqueta):
+                yield etiqueta
+        yield from pendientes
+
+    def _precalentar(self, etiqueta):
+        listo = self._listo_vigente(etiqueta)
+        ruta = listo[1] if listo else self.pdf_service.crear_pdf_etiqueta(etiqueta)
+
+        if self.interrumpir.is_set():
+            return
+        firma = precalentar_tiles(ruta, PRECALENTAR_ALTO_PX, self.interrumpir)
+        with self.lock:
+            self.listos[etiqueta.id] = (_contenido_etiqueta(etiqueta), ruta, firma)
 
 class VentanaNueva:
     """Ventana emergente para crear una nueva etiqueta y su PDF"""
@@ -206,9 +321,8 @@ class VentanaEditar:
         try:
             exito = manager.modificar(self.etiqueta.id, **nuevos_datos)
             if exito:
-                self.etiqueta.articulo = nuevos_datos["articulo"]
-                self.etiqueta.medida = nuevos_datos["medida"]
-                self.etiqueta.cantidad = nuevos_datos["cantidad"]
+                # Solo el hilo de Tk toca las filas del catálogo; los hilos de fondo usan snapshots
+                self.etiqueta.actualizar(**nuevos_datos)
                 self.callback_actualizar() 
                 self.top.destroy()
         finally:
@@ -225,16 +339,35 @@ class InterfazEstricta:
         # Eliminamos vcmd porque ya no validamos solo números
         
         self.filas = [] 
-        self.etiquetas_cache = [] 
+        self.catalogo = None      # CatalogoSnapshot (mapeado) o CatalogoEnMemoria
+        self.resultados = []      # lo que muestra la tabla; se renderiza por lotes
+        self.renderizadas = 0
+        self.lote_pendiente = None
+        self.cantidades = {}      # id -> cantidad de hojas ingresada en la tabla
         self.search_timer = None  
         
         self.ANCHO_SELECCION = 60
         self.ANCHO_CANTIDAD = 120
         self.ALTO_FILA = 32   
 
+        self.precalentador = PrecalentadorEtiquetas(self.root, self.pdf_service)
+
         self.crear_interfaz()
+        for evento in ("<KeyPress>", "<ButtonPress>", "<MouseWheel>"):
+            self.root.bind_all(evento, self.precalentador.interaccion, add="+")
         self.cargar_datos_iniciales()
 
+        # Limpia PDFs truncados / temporales de una corrida interrumpida y blobs
+        # que ya no usa ninguna etiqueta, sin demorar el arranque
+        threading.Thread(target=self._mantenimiento_pdfs, daemon=True).start()
+
+    def _mantenimiento_pdfs(self):
+        try:
+            self.pdf_service.validar_pdfs()
+            self.pdf_service.limpiar_blobs_huerfanos()
+        except Exception as e:
+            print(f"Error en el mantenimiento de PDFs: {e}")
+
     def crear_interfaz(self):
         print("creando interfaz")#borrar
         top = tk.Frame(self.root, bg="#f2f2f2")
@@ -266,7 +399,8 @@ class InterfazEstricta:
 
         self.canvas = tk.Canvas(container, bg="#f2f2f2", highlightthickness=0)
         scrollbar = ttk.Scrollbar(container, orient="vertical", command=self.canvas.yview)
-        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.configure(yscrollcommand=lambda primero, ultimo: (
+            scrollbar.set(primero, ultimo), self._on_scroll_tabla(float(ultimo))))
 
         self.scrollable = tk.Frame(self.canvas, bg="#f2f2f2")
         self.scrollable.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
@@ -297,38 +431,121 @@ class InterfazEstricta:
     def _ejecutar_busqueda(self):
         query = self.entry_search.get().lower().strip()
         if query == "buscar etiqueta..." or not query:
-            self.renderizar_tabla(self.etiquetas_cache)
+            self.renderizar_tabla(self.catalogo)
             return
 
-        terminos = query.split()
-        resultados = []
-        for etiqueta in self.etiquetas_cache:
-            contenido_fila = f"{etiqueta.carpeta} {etiqueta.medida} {etiqueta.articulo}".lower().replace("-", "/")
-            if all(t in contenido_fila for t in terminos):
-                resultados.append(etiqueta)
-        self.renderizar_tabla(resultados)
+        # La búsqueda corre sobre los textos ya normalizados del catálogo, sin decodificar filas
+        self.renderizar_tabla(self.catalogo.buscar(query.split()))
 
     def cargar_datos_iniciales(self):
         print("cargando datos iniciales")#borrar
+        if self.catalogo is not None:
+            self.catalogo.cerrar()   # libera el mapeo para poder reescribir el snapshot
+            self.catalogo = None
+        self.cantidades.clear()
+
+        # Camino rápido: el snapshot ya ordenado, si coincide con la DB en disco
+        catalogo = CatalogoSnapshot.abrir(DB_PATH_DEFAULT)
+        if catalogo:
+            self.catalogo = catalogo
+            self.renderizar_tabla(self.catalogo)
+            self._verificar_catalogo(catalogo)
+            return
+
         manager = EtiquetaManager()
         try:
-            raw_etiquetas = manager.listar_todas()
-            self.etiquetas_cache = sorted(raw_etiquetas, key=lambda e: f"{e.articulo} {e.medida}".lower())
-            for e in self.etiquetas_cache:
-                e.cantidad_temp = "" 
-            self.renderizar_tabla(self.etiquetas_cache)
+            firma = firma_db(DB_PATH_DEFAULT)
+            self.catalogo = self._construir_catalogo(manager.listar_todas(), firma)
+            self.renderizar_tabla(self.catalogo)
         finally:
             manager.cerrar()
 
-    def renderizar_tabla(self, lista_etiquetas):
+    def _construir_catalogo(self, etiquetas, firma):
+        """Reescribe el snapshot y lo abre; si falla, el catálogo queda en memoria (es solo una cache)."""
+        try:
+            escribir_snapshot(DB_PATH_DEFAULT, etiquetas, firma)
+            catalogo = CatalogoSnapshot.abrir(DB_PATH_DEFAULT)
+            if catalogo:
+                return catalogo
+        except Exception as e:
+            print(f"No se pudo escribir el snapshot del catálogo: {e}")
+        return CatalogoEnMemoria(etiquetas)
+
+    def _verificar_catalogo(self, catalogo):
+        """
+        Compara lo que el snapshot decodifica con SQLite en segundo plano y
+        refresca la lista si no coinciden (no alcanza con el hash de la
+        cabecera: el archivo puede estar dañado aunque la cabecera esté bien).
+        """
+        resultado = {}
+
+        def _worker():
+            manager = EtiquetaManager()
+            try:
+                resultado["firma"] = firma_db(DB_PATH_DEFAULT)
+                etiquetas = manager.listar_todas()
+                try:
+                    hash_snapshot = catalogo.hash_decodificado()
+                except UnicodeDecodeError:
+                    hash_snapshot = None
+                if hash_contenido(etiquetas) != hash_snapshot:
+                    resultado["etiquetas"] = [EtiquetaSnapshot.desde(e) for e in etiquetas]
+            except Exception as e:
+                print(f"Error verificando el catálogo: {e}")
+            finally:
+                manager.cerrar()
+
+        hilo = threading.Thread(target=_worker, daemon=True)
+        hilo.start()
+
+        def _esperar():
+            # Tk no es seguro entre hilos: el resultado se aplica desde acá
+            if hilo.is_alive():
+                self.root.after(200, _esperar)
+                return
+            etiquetas = resultado.get("etiquetas")
+            if etiquetas is None or self.catalogo is not catalogo:
+                return
+            if firma_db(DB_PATH_DEFAULT) != resultado["firma"]:
+                # La DB cambió mientras tanto (ediciones desde esta misma ventana): la lista en memoria ya las tiene
+                return
+            # El snapshot se reescribe desde el hilo de Tk: primero hay que soltar el mapeo actual.
+            # Las cantidades ingresadas van por id, así que se conservan.
+            self.catalogo.cerrar()
+            self.catalogo = self._construir_catalogo(etiquetas, resultado["firma"])
+            self._ejecutar_busqueda()
+
+        self.root.after(200, _esperar)
+
+    def renderizar_tabla(self, resultados):
+        """resultados: secuencia perezosa (catálogo o búsqueda); se crean filas por lotes."""
         print("renderizando tabla")#borrar
         self.limpiar_tabla()
-        for etiqueta in lista_etiquetas:
+        if self.lote_pendiente is not None:
+            self.root.after_cancel(self.lote_pendiente)
+            self.lote_pendiente = None
+        self.canvas.yview_moveto(0)
+        self.resultados = resultados
+        self.renderizadas = 0
+        self._renderizar_lote()
+        self.precalentador.programar([fila["obj"] for fila in self.filas])
+        print("se renderizo la la tabla")#borrar
+
+    def _renderizar_lote(self):
+        self.lote_pendiente = None
+        fin = min(len(self.resultados), self.renderizadas + LOTE_FILAS)
+        for i in range(self.renderizadas, fin):
+            etiqueta = self.resultados[i]
             # Mostramos medida con barras
             medida_display = etiqueta.medida.replace('-', '/') if etiqueta.medida else ""
             texto = f"{etiqueta.carpeta.split('/')[0]} | {medida_display} | {etiqueta.articulo} | {etiqueta.cantidad}"
             self.agregar_fila(etiqueta, texto)
-        print("se renderizo la la tabla")#borrar
+        self.renderizadas = fin
+
+    def _on_scroll_tabla(self, ultimo):
+        # Cerca del final de lo ya creado, agregamos el siguiente lote
+        if ultimo > 0.9 and self.renderizadas < len(self.resultados) and self.lote_pendiente is None:
+            self.lote_pendiente = self.root.after_idle(self._renderizar_lote)
 
     def agregar_fila(self, etiqueta_obj, texto):
         row = tk.Frame(self.scrollable, bg="white", height=self.ALTO_FILA)
@@ -343,10 +560,11 @@ class InterfazEstricta:
 
         # --- NUEVO: BOTÓN VER PDF (OJO) ---
         def ver_pdf():
-            service = EtiquetaPDFService()
-            # Obtenemos la ruta del PDF. Si no existe, lo crea.
-            ruta = service.crear_pdf_etiqueta(etiqueta_obj) 
-            VisualizadorPDF(self.root, ruta)
+            # Si el precalentador ya lo dejó listo con el contenido actual, lo usamos directo
+            ruta = self.precalentador.obtener(etiqueta_obj)
+            if ruta is None:
+                ruta = self.pdf_service.crear_pdf_etiqueta(etiqueta_obj)
+            VisualizadorPDF(self.root, ruta, al_interactuar=self.precalentador.interaccion)
 
         btn_view = tk.Button(row, text="👁", font=("Segoe UI", 11), bg="white", fg="#27ae60",
                              relief="flat", cursor="hand2", borderwidth=0, width=4,
@@ -360,8 +578,8 @@ class InterfazEstricta:
         qty_container = tk.Frame(row, bg="#d0d0d0", padx=1, pady=1)
         qty_container.pack(side="right", padx=18)
 
-        qty_var = tk.StringVar(value=etiqueta_obj.cantidad_temp)
-        qty_var.trace_add("write", lambda *a: setattr(etiqueta_obj, 'cantidad_temp', qty_var.get()))
+        qty_var = tk.StringVar(value=self.cantidades.get(etiqueta_obj.id, ""))
+        qty_var.trace_add("write", lambda *a: self.cantidades.__setitem__(etiqueta_obj.id, qty_var.get()))
 
         cell_qty = tk.Entry(qty_container, width=10, justify="center", textvariable=qty_var,
                             font=("Segoe UI", 10, "bold"), relief="flat", bg="white", fg="#222")
@@ -370,21 +588,25 @@ class InterfazEstricta:
         self.filas.append({"obj": etiqueta_obj, "var": qty_var})
 
     def limpiar_todas_las_cantidades(self):
-        for etiqueta in self.etiquetas_cache:
-            etiqueta.cantidad_temp = ""
+        self.cantidades.clear()
         self._ejecutar_busqueda()
 
     def imprimir_etiquetas_ingresadas(self):
         lista_para_imprimir = []
-        for etiqueta in self.etiquetas_cache:
-            valor = etiqueta.cantidad_temp.strip()
+        for etiqueta_id, valor in self.cantidades.items():
+            valor = valor.strip()
             if valor: # Si hay algo escrito (sea número o "2 kg")
                 # NOTA: Asegúrate que tu pdf_service soporte strings en la cantidad o extrae el número
-                lista_para_imprimir.append((etiqueta.id, valor))
+                lista_para_imprimir.append((etiqueta_id, valor))
         
         if not lista_para_imprimir: return
-        
+
+        # Se imprime en el orden del catálogo, no en el que se tipearon las cantidades
+        posiciones = self.catalogo.posiciones(etiqueta_id for etiqueta_id, _ in lista_para_imprimir)
+        lista_para_imprimir.sort(key=lambda par: posiciones.get(par[0], len(self.catalogo)))
+
         self.pdf_service.imprimir_lista_etiquetas(lista_para_imprimir)
+        self.precalentador.registrar_impresas([etiqueta_id for etiqueta_id, _ in lista_para_imprimir])
         self.limpiar_todas_las_cantidades()
 
     def _on_mousewheel(self, event):
@@ -0,0 +1,339 @@
+import math
+import os
+import threading
+import tkinter as tk
+from tkinter import messagebox
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageTk
+
+ZOOM_PREVIEW = 2.5   # zoom inicial de la previsualización
+ZOOM_MIN = 0.5
+ZOOM_MAX = 6.0
+ZOOM_PASO = 1.25
+
+TILE = 512           # lado de cada tile en píxeles
+MARGEN = 20          # separación entre páginas y bordes del canvas
+CACHE_TILES_MAX_MB = 48
+
+# MuPDF no es seguro entre hilos: serializamos todo el acceso a fitz
+fitz_lock = threading.Lock()
+
+
+class CacheTiles:
+    """LRU de tiles rasterizados (PIL) con límite en bytes, compartida entre hilos"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self.lock:
+            img = self.tiles.get(clave)
+            if img is not None:
+                self.tiles.move_to_end(clave)
+            return img
+
+    def contiene(self, clave):
+        with self.lock:
+            return clave in self.tiles
+
+    def guardar(self, clave, img):
+        with self.lock:
+            if clave in self.tiles:
+                return
+            self.tiles[clave] = img
+            self.bytes += _bytes_imagen(img)
+            while self.bytes > self.max_bytes and self.tiles:
+                _, viejo = self.tiles.popitem(last=False)
+                self.bytes -= _bytes_imagen(viejo)
+
+
+CACHE_TILES = CacheTiles(CACHE_TILES_MAX_MB * 1024 * 1024)
+
+
+def _bytes_imagen(img):
+    return img.width * img.height * 3
+
+
+def firma_pdf(ruta_pdf):
+    """Identifica una versión concreta del archivo: si se regenera, cambia la firma."""
+    st = os.stat(ruta_pdf)
+    return (os.path.abspath(ruta_pdf), st.st_mtime_ns, st.st_size)
+
+
+def abrir_pdf(ruta_pdf):
+    """
+    Abre el PDF desde memoria: no deja el archivo tomado, así el servicio
+    puede reemplazarlo (os.replace) aunque haya un visor abierto.
+    """
+    with open(ruta_pdf, "rb") as f:
+        datos = f.read()
+    return fitz.open(stream=datos, filetype="pdf")
+
+
+def clave_tile(firma, num_pagina, zoom, tx, ty):
+    return (firma, num_pagina, round(zoom, 3), tx, ty)
+
+
+def obtener_tile(doc, firma, num_pagina, zoom, tx, ty):
+    """Devuelve el tile (tx, ty) de la página al zoom pedido, usando la cache si está."""
+    clave = clave_tile(firma, num_pagina, zoom, tx, ty)
+    img = CACHE_TILES.obtener(clave)
+    if img is not None:
+        return img
+
+    with fitz_lock:
+        page = doc.load_page(num_pagina)
+        r = page.rect
+        # El tile está en píxeles; lo pasamos a coordenadas PDF para recortar
+        clip = fitz.Rect(
+            r.x0 + tx * TILE / zoom,
+            r.y0 + ty * TILE / zoom,
+            min(r.x1, r.x0 + (tx + 1) * TILE / zoom),
+            min(r.y1, r.y0 + (ty + 1) * TILE / zoom),
+        )
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+    CACHE_TILES.guardar(clave, img)
+    return img
+
+
+def tiles_vista_inicial(ancho_pt, alto_pt, alto_px):
+    """Columnas y filas de tiles que cubren la vista inicial de una página (zoom inicial, primeros alto_px)"""
+    columnas = math.ceil(ancho_pt * ZOOM_PREVIEW / TILE)
+    filas = min(math.ceil(alto_pt * ZOOM_PREVIEW / TILE), math.ceil(alto_px / TILE))
+    return columnas, filas
+
+
+def bytes_vista_inicial(ancho_pt, alto_pt, alto_px):
+    """Cota de lo que ocupan en CACHE_TILES los tiles de la vista inicial de una página"""
+    columnas, filas = tiles_vista_inicial(ancho_pt, alto_pt, alto_px)
+    return columnas * filas * TILE * TILE * 3
+
+
+def precalentar_tiles(ruta_pdf, alto_px, cancelado=None):
+    """
+    Rasteriza de antemano los tiles que el visor muestra al abrirse
+    (primera página, zoom inicial, primeros alto_px píxeles).
+    Devuelve la firma del archivo renderizado.
+    """
+    firma = firma_pdf(ruta_pdf)
+    with fitz_lock:
+        doc = abrir_pdf(ruta_pdf)
+        r = doc.load_page(0).rect
+    try:
+        columnas, filas = tiles_vista_inicial(r.width, r.height, alto_px)
+        for ty in range(filas):
+            for tx in range(columnas):
+                if cancelado is not None and cancelado.is_set():
+                    return firma
+                obtener_tile(doc, firma, 0, ZOOM_PREVIEW, tx, ty)
+    finally:
+        with fitz_lock:
+            doc.close()
+    return firma
+
+
+class VisualizadorPDF:
+    """
+    Ventana independiente para previsualizar PDFs (todas las páginas) con zoom y scroll.
+    Solo se rasterizan los tiles visibles; los que salen de la vista se liberan.
+    al_interactuar: callback opcional que se llama con cada evento de rueda,
+    ya que esos eventos no llegan a los bind_all de la ventana principal.
+    """
+    def __init__(self, parent, ruta_pdf, al_interactuar=None):
+        self.top = tk.Toplevel(parent)
+        self.al_interactuar = al_interactuar
+        self.top.title("Previsualización de Etiqueta")
+
+        # --- 1. CONFIGURACIÓN DE TAMAÑO Y CENTRADO ---
+        ancho_ventana = 800
+        alto_ventana = self.top.winfo_screenheight() - 100 # Casi el alto total de pantalla
+
+        # Obtener dimensiones de la pantalla para centrar
+        screen_width = self.top.winfo_screenwidth()
+
+        pos_x = (screen_width // 2) - (ancho_ventana // 2)
+        pos_y = 0 # Aparece arriba centrado
+
+        self.top.geometry(f"{ancho_ventana}x{alto_ventana}+{pos_x}+{pos_y}")
+        self.top.configure(bg="#34495e")
+
+        # --- 2. BARRA DE ZOOM ---
+        barra = tk.Frame(self.top, bg="#34495e")
+        barra.pack(fill="x")
+
+        for texto, factor in (("−", 1 / ZOOM_PASO), ("+", ZOOM_PASO)):
+            tk.Button(barra, text=texto, font=("Segoe UI", 11, "bold"), bg="#2c3e50", fg="white",
+                      relief="flat", width=3, cursor="hand2",
+                      command=lambda f=factor: self.cambiar_zoom(f)).pack(side="left", padx=(6, 0), pady=4)
+        self.lbl_zoom = tk.Label(barra, font=("Segoe UI", 9, "bold"), bg="#34495e", fg="white")
+        self.lbl_zoom.pack(side="left", padx=10)
+
+        # --- 3. CONTENEDOR CON SCROLLS (VERTICAL Y HORIZONTAL) ---
+        # Frame contenedor para organizar canvas y barras
+        container = tk.Frame(self.top, bg="#34495e")
+        container.pack(fill="both", expand=True)
+
+        self.canvas = tk.Canvas(container, bg="grey", highlightthickness=0)
+
+        scroll_y = tk.Scrollbar(container, orient="vertical", command=self.canvas.yview)
+        scroll_x = tk.Scrollbar(self.top, orient="horizontal", command=self.canvas.xview) # En la base de la ventana
+
+        # Cada movimiento del scroll pide los tiles que quedaron a la vista
+        self.canvas.configure(
+            yscrollcommand=lambda *a: (scroll_y.set(*a), self._agendar_render()),
+            xscrollcommand=lambda *a: (scroll_x.set(*a), self._agendar_render()),
+        )
+
+        # Empaquetado de componentes
+        scroll_y.pack(side="right", fill="y")
+        scroll_x.pack(side="bottom", fill="x")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.zoom = ZOOM_PREVIEW
+        self.doc = None
+        self.tiles = {}          # (pagina, tx, ty) -> (item del canvas, PhotoImage)
+        self.posiciones = []     # (x, y, ancho, alto) de cada página en el canvas
+        self.render_pendiente = None
+
+        try:
+            self.firma = firma_pdf(ruta_pdf)
+            with fitz_lock:
+                self.doc = abrir_pdf(ruta_pdf)
+                self.paginas = [(p.rect.width, p.rect.height) for p in self.doc]
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo renderizar el PDF: {e}")
+            self.top.destroy()
+            return
+
+        self.top.bind("<Destroy>", self._al_cerrar)
+        self.canvas.bind("<Configure>", lambda e: self._agendar_render())
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Control-MouseWheel>", self._on_zoom_rueda)
+
+        self._maquetar()
+
+    # ------------------------------------------------------------------
+    # ZOOM Y MAQUETADO
+    # ------------------------------------------------------------------
+
+    def cambiar_zoom(self, factor):
+        nuevo = min(ZOOM_MAX, max(ZOOM_MIN, self.zoom * factor))
+        if nuevo == self.zoom:
+            return
+        # Conservamos la posición relativa de la vista
+        frac_x = self.canvas.xview()[0]
+        frac_y = self.canvas.yview()[0]
+        self.zoom = nuevo
+        self._maquetar()
+        self.canvas.xview_moveto(frac_x)
+        self.canvas.yview_moveto(frac_y)
+
+    def _maquetar(self):
+        """Ubica las páginas (como rectángulos vacíos) para el zoom actual."""
+        self.canvas.delete("all")
+        self.tiles.clear()
+        self.posiciones = []
+
+        ancho_max = max(w for w, h in self.paginas) * self.zoom
+        y = MARGEN
+        for w, h in self.paginas:
+            w_px, h_px = round(w * self.zoom), round(h * self.zoom)
+            x = MARGEN + round((ancho_max - w_px) / 2)
+            self.posiciones.append((x, y, w_px, h_px))
+            self.canvas.create_rectangle(x, y, x + w_px, y + h_px, fill="white", outline="")
+            y += h_px + MARGEN
+
+        self.canvas.config(scrollregion=(0, 0, ancho_max + 2 * MARGEN, y))
+        self.lbl_zoom.config(text=f"{round(self.zoom * 100)}%")
+        self._agendar_render()
+
+    # ------------------------------------------------------------------
+    # RENDER PEREZOSO DE TILES
+    # ------------------------------------------------------------------
+
+    def _agendar_render(self):
+        if self.render_pendiente is None and self.doc is not None:
+            self.render_pendiente = self.top.after_idle(self._render_visibles)
+
+    def _tiles_visibles(self):
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        x1 = x0 + self.canvas.winfo_width()
+        y1 = y0 + self.canvas.winfo_height()
+
+        visibles = []
+        for num, (px, py, w_px, h_px) in enumerate(self.posiciones):
+            if py > y1 or py + h_px < y0 or px > x1 or px + w_px < x0:
+                continue
+            tx_ini = max(0, int((x0 - px) // TILE))
+            tx_fin = min((w_px - 1) // TILE, int((x1 - px) // TILE))
+            ty_ini = max(0, int((y0 - py) // TILE))
+            ty_fin = min((h_px - 1) // TILE, int((y1 - py) // TILE))
+            for ty in range(ty_ini, ty_fin + 1):
+                for tx in range(tx_ini, tx_fin + 1):
+                    visibles.append((num, tx, ty))
+        return visibles
+
+    def _render_visibles(self):
+        self.render_pendiente = None
+        visibles = self._tiles_visibles()
+
+        # Liberamos los tiles que salieron de la vista (la cache conserva el raster)
+        en_vista = set(visibles)
+        for clave in [c for c in self.tiles if c not in en_vista]:
+            item, _ = self.tiles.pop(clave)
+            self.canvas.delete(item)
+
+        faltantes = [c for c in visibles if c not in self.tiles]
+        if not faltantes:
+            return
+
+        # Un tile por ciclo ocioso: el primero aparece enseguida y la ventana no se congela
+        num, tx, ty = faltantes[0]
+        try:
+            img = obtener_tile(self.doc, self.firma, num, self.zoom, tx, ty)
+        except Exception as e:
+            print(f"Error renderizando tile {faltantes[0]}: {e}")
+            return
+        foto = ImageTk.PhotoImage(img)
+        px, py = self.posiciones[num][:2]
+        item = self.canvas.create_image(px + tx * TILE, py + ty * TILE, image=foto, anchor="nw")
+        self.tiles[(num, tx, ty)] = (item, foto)
+
+        if len(faltantes) > 1:
+            self._agendar_render()
+
+    # ------------------------------------------------------------------
+    # EVENTOS
+    # ------------------------------------------------------------------
+
+    def _notificar_interaccion(self, event):
+        if self.al_interactuar is not None:
+            self.al_interactuar(event)
+
+    def _on_mousewheel(self, event):
+        self._notificar_interaccion(event)
+        self.canvas.yview_scroll(int(-event.delta / 120), "units")
+        return "break"   # que no llegue al bind_all de la ventana principal
+
+    def _on_zoom_rueda(self, event):
+        self._notificar_interaccion(event)
+        self.cambiar_zoom(ZOOM_PASO if event.delta > 0 else 1 / ZOOM_PASO)
+        return "break"
+
+    def _al_cerrar(self, event):
+        if event.widget is not self.top or self.doc is None:
+            return
+        if self.render_pendiente is not None:
+            self.top.after_cancel(self.render_pendiente)
+            self.render_pendiente = None
+        with fitz_lock:
+            self.doc.close()
+        self.doc = None
+        self.tiles.clear()